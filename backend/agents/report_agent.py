@@ -6,28 +6,165 @@
 from agno.agent import Agent
 from agno.models.dashscope import DashScope
 from config.settings import settings  # 从settings获取配置
-from typing import AsyncGenerator, Union, Dict, Any, List, Optional
+from typing import AsyncGenerator, AsyncIterator, Union, Dict, Any, Final, List, Optional
 from pathlib import Path
+from functools import lru_cache
+from cachetools import TTLCache
+import asyncio
+import contextlib
+import hashlib
+import importlib
+import importlib.metadata
+import importlib.util
 import logging
 import os
+import orjson
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# Agent 固定配置（每次运行构建Agent时复用）
+_DASHSCOPE_BASE_URL: Final[str] = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+_INSTRUCTIONS: Final[tuple] = (
+    "你是一个交互式报告写作助手",
+    "根据当前任务选择合适的技能指南",
+    "回答要专业、客观、简洁",
+    "不确定时如实告知，不编造信息",
+    "保持友好的对话风格",
+)
+_RUN_QUEUE_SIZE: Final[int] = 32  # run() 中模型输出与调用方消费之间的缓冲片段数
+_DESCRIPTION: Final[str] = "我是一个专业的报告写作助手，可以帮助你撰写技术报告、市场分析、学术综述等各种类型的报告。"
+
+# skills目录：当前文件在 agents/report_agent.py，项目根目录为 agents/..
+_SKILLS_DIR: Final[Path] = Path(__file__).resolve().parent.parent / "skills"
+_SKILLS_DIR_EXISTS: Final[bool] = _SKILLS_DIR.is_dir()
+# 导入时扫描一次可用的Skill：名称 -> 目录路径
+_SKILL_PATHS: Final[Dict[str, str]] = (
+    {p.name: str(p) for p in _SKILLS_DIR.iterdir() if p.is_dir()} if _SKILLS_DIR_EXISTS else {}
+)
+
+
+def _has_module(name: str) -> bool:
+    """检查模块是否可导入（逐级检查父包，全程不触发 ImportError）"""
+    parts = name.split(".")
+    for i in range(1, len(parts) + 1):
+        if importlib.util.find_spec(".".join(parts[:i])) is None:
+            return False
+    return True
+
+
+def _detect_skills_loader():
+    """
+    探测当前Agno版本支持的Skill加载方式（兼容不同版本的Agno），进程内只执行一次
+    
+    Returns:
+        接收Skill目录路径列表、返回Skills对象的函数；不支持时返回None
+    """
+    try:
+        logger.info(f"Agno版本: {importlib.metadata.version('agno')}")
+    except importlib.metadata.PackageNotFoundError:
+        pass
+    if not _has_module("agno.skills"):
+        return None
+    skills_module = importlib.import_module("agno.skills")
+
+    # 方式1：agno.skills.Skills + LocalSkillsLoader
+    if _has_module("agno.skills.loaders.local"):
+        local_module = importlib.import_module("agno.skills.loaders.local")
+        if hasattr(local_module, "LocalSkillsLoader"):
+            logger.info("使用 LocalSkillsLoader 加载Skill")
+            return lambda paths: skills_module.Skills(loaders=[local_module.LocalSkillsLoader(path) for path in paths])
+
+    # 方式2：agno.skills.Skills + LocalSkills
+    if hasattr(skills_module, "Skills") and hasattr(skills_module, "LocalSkills"):
+        logger.info("使用 LocalSkills 加载Skill")
+        return lambda paths: skills_module.Skills(loaders=[skills_module.LocalSkills(path) for path in paths])
+
+    # 方式3：Agno 旧版本API
+    if hasattr(skills_module, "SkillSet"):
+        logger.info("使用 SkillSet 加载Skill")
+        return skills_module.SkillSet.from_directories
+
+    return None
+
+
+# 模块导入时确定Skill加载方式
+_SKILLS_LOADER = _detect_skills_loader()
+
+
+@lru_cache(maxsize=None)
+def _load_skills(skill_names: tuple) -> Optional[Any]:
+    """
+    加载指定的Skill文件（按名称组合缓存，同一组合只加载一次）
+    
+    Args:
+        skill_names: Skill名称元组
+        
+    Returns:
+        Skills对象或None（如果加载失败）
+    """
+    print(f"📂 开始加载Skills: {skill_names}")
+    try:
+        # 检查skills目录是否存在
+        if not _SKILLS_DIR_EXISTS:
+            logger.warning(f"⚠️ Skills目录不存在: {_SKILLS_DIR}")
+            print(f"⚠️ Skills目录不存在: {_SKILLS_DIR}")
+            return None
+        
+        # 确定要加载的Skill路径（查预扫描的目录表，不再逐个stat）
+        skill_paths = []
+        for name in skill_names:
+            skill_path = _SKILL_PATHS.get(name)
+            if skill_path:
+                skill_paths.append(skill_path)
+                logger.info(f"找到Skill: {name} at {skill_path}")
+            else:
+                logger.warning(f"⚠️ Skill不存在: {name}")
+                print(f"⚠️ Skill不存在: {name}，跳过")
+        
+        if not skill_paths:
+            logger.info("没有找到任何有效的Skill")
+            return None
+        
+        if _SKILLS_LOADER is None:
+            logger.warning("⚠️ 无法加载Skills：当前Agno版本可能不支持，或需要安装额外依赖")
+            print("⚠️ 无法加载Skills，将使用基础功能继续运行")
+            return None
+
+        skills = _SKILLS_LOADER(skill_paths)
+        logger.info(f"✅ 加载了 {len(skill_paths)} 个Skill")
+        return skills
+        
+    except Exception as e:
+        logger.error(f"加载Skills时出错: {e}")
+        print(f"⚠️ 加载Skills时出错: {e}，将不使用Skill继续运行")
+        return None
+
+def _response_cache_key(model_id: str, task: Union[str, List]) -> str:
+    """
+    相同提示词的缓存键：只取消息的角色和内容（时间戳等字段不影响回答）
+    
+    Args:
+        model_id: 模型ID（不同模型的回答分开缓存）
+        task: 任务描述或消息列表
+    """
+    if isinstance(task, str):
+        normalized = task  # 按原文作为键（与消息列表一致，不做大小写/空白归一化）
+    else:
+        normalized = [(m.get("role"), m.get("content")) for m in task]
+    raw = orjson.dumps([model_id, normalized])
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
 class ReportAgent:
     """
     基础报告写作Agent
     职责：处理基础的对话和写作任务，支持可选加载Skill
     """
-    # 单例模式：类变量
-    _instance = None
-    _initialized = False
-    
-    def __new__(cls, *args, **kwargs):
-        """单例模式：确保只有一个实例"""
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
-        return cls._instance
+    # 共享资源：模型客户端与Skills在进程内只构建一次，各次运行共用
+    # 每次 run() 构建轻量的 Agent，避免并发对话共享同一个 Agent 的运行状态
+    _shared_models: Dict[str, DashScope] = {}
+
     def __init__(self, model_id: str = "qwen-plus", skill_names: Optional[List[str]] = None):
         """
         初始化Agent
@@ -37,10 +174,6 @@ class ReportAgent:
             skill_names: 要加载的Skill名称列表，如 ["report-writing", "tool-usage-strategy"]
                          如果为None或空列表，则不加载任何Skill（保持基础功能）
         """
-
-        # 单例模式：如果已经初始化过，直接返回
-        if self._initialized:
-            return
         # 从settings获取API Key
         api_key = settings.OPENAI_API_KEY
         if not api_key:
@@ -54,129 +187,63 @@ class ReportAgent:
         
         # 基础指令
         print("skill_names...", skill_names)
-        self.agent = Agent(
-            model=DashScope(
+        cls = type(self)
+        if model_id not in cls._shared_models:
+            cls._shared_models[model_id] = DashScope(
                 id=model_id,
                 api_key=api_key,
-                base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
-            ),
-            instructions= [
-                "你是一个交互式报告写作助手",
-                "根据当前任务选择合适的技能指南",
-                "回答要专业、客观、简洁",
-                "不确定时如实告知，不编造信息",
-                "保持友好的对话风格",
-            ],
-            description="我是一个专业的报告写作助手，可以帮助你撰写技术报告、市场分析、学术综述等各种类型的报告。",
-            skills=self._load_skills(skill_names)
+                base_url=_DASHSCOPE_BASE_URL
+            )
 
+        self.model_id = model_id
+        self.model = cls._shared_models[model_id]
+        self.skills = _load_skills(tuple(skill_names)) if skill_names else None
+        # 相同提示词的回答缓存（只缓存完整生成的回答）；容量为0时不缓存
+        self._response_cache: Optional[TTLCache] = (
+            TTLCache(maxsize=settings.LLM_CACHE_SIZE, ttl=settings.LLM_CACHE_TTL)
+            if settings.LLM_CACHE_SIZE > 0 else None
         )
         print(f"✅ Agent初始化完成，使用模型: {model_id}")
-         # 标记为已初始化
-        self._initialized = True
+
+    def _build_agent(self) -> Agent:
+        """构建一次运行使用的 Agent（模型与Skills为共享实例）"""
+        return Agent(
+            model=self.model,
+            instructions=list(_INSTRUCTIONS),
+            description=_DESCRIPTION,
+            skills=self.skills
+        )
     
-    def _load_skills(self, skill_names: List[str]) -> Optional[Any]:
+    async def stream(self, task: Union[str, List]) -> AsyncIterator[str]:
         """
-        加载指定的Skill文件
+        流式执行任务，直接产出文本片段（不包装为字典，由调用方决定如何下发）
         
         Args:
-            skill_names: Skill名称列表
-            
-        Returns:
-            Skills对象或None（如果加载失败）
-        """
-        print(f"📂 开始加载Skills: {skill_names}")
-        try:
-            # 计算skills目录路径
-            # 当前文件在: agents/report_agent.py
-            # 项目根目录: agents/../../ (即项目根目录)
-            current_file = Path(__file__).resolve()  # agents/report_agent.py
-            project_root = current_file.parent.parent  # 项目根目录
-            skills_dir = project_root / "skills"
-            
-            # 检查skills目录是否存在
-            if not skills_dir.exists():
-                logger.warning(f"⚠️ Skills目录不存在: {skills_dir}")
-                print(f"⚠️ Skills目录不存在: {skills_dir}")
-                return None
-            
-            # 确定要加载的Skill路径
-            print("确定要加载的Skill路径...")
-            skill_paths = []
-            for name in skill_names:
-                skill_path = skills_dir / name
-                if skill_path.exists() and skill_path.is_dir():
-                    skill_paths.append(str(skill_path))
-                    logger.info(f"找到Skill: {name} at {skill_path}")
-                    print("001....")
-                else:
-                    logger.warning(f"⚠️ Skill不存在: {name}")
-                    print(f"⚠️ Skill不存在: {name}，跳过")
-            
-            if not skill_paths:
-                logger.info("没有找到任何有效的Skill")
-                return None
-            
-            # 尝试加载Skills（兼容不同版本的Agno）
-            return self._try_load_skills(skill_paths)
-            
-        except Exception as e:
-            logger.error(f"加载Skills时出错: {e}")
-            print(f"⚠️ 加载Skills时出错: {e}，将不使用Skill继续运行")
-            return None
-    
-    def _try_load_skills(self, skill_paths: List[str]) -> Optional[Any]:
-        """
-        尝试不同的方式加载Skills（兼容不同Agno版本）
+            task: 任务描述或消息列表
         
-        Args:
-            skill_paths: Skill目录路径列表
-            
-        Returns:
-            Skills对象或None
+        Yields:
+            文本增量片段（命中缓存时整段产出）
         """
-        # 方式1：尝试 agno.skills.Skills + LocalSkillsLoader
-        try:
-            from agno.skills import Skills
-            from agno.skills.loaders.local import LocalSkillsLoader
-            
-            skills = Skills(loaders=[
-                LocalSkillsLoader(path) for path in skill_paths
-            ])
-            logger.info(f"✅ 使用 LocalSkillsLoader 加载了 {len(skill_paths)} 个Skill")
-            print("002....")
-
-            return skills
-        except ImportError:
-            logger.debug("方式1导入失败，尝试方式2")
-        
-        # 方式2：尝试 agno.skills.Skills + LocalSkills
-        try:
-            from agno.skills import Skills, LocalSkills
-            
-            skills = Skills(loaders=[
-                LocalSkills(path) for path in skill_paths
-            ])
-            print("003....",f"✅ 使用 LocalSkills 加载了 {len(skill_paths)} 个Skill")
-            logger.info(f"✅ 使用 LocalSkills 加载了 {len(skill_paths)} 个Skill")
-            return skills
-        except ImportError:
-            logger.debug("方式2导入失败，尝试方式3")
-        
-        # 方式3：尝试直接使用 Agno 的旧版本API
-        try:
-            from agno.skills import SkillSet
-            
-            skills = SkillSet.from_directories(skill_paths)
-            logger.info(f"✅ 使用 SkillSet 加载了 {len(skill_paths)} 个Skill")
-            return skills
-        except ImportError:
-            logger.debug("方式3导入失败")
-        
-        logger.warning("⚠️ 无法加载Skills：当前Agno版本可能不支持，或需要安装额外依赖")
-        print("⚠️ 无法加载Skills，将使用基础功能继续运行")
-        return None
-    
+        cache = self._response_cache
+        key = _response_cache_key(self.model_id, task) if cache is not None else None
+        if key is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                logger.info("命中回答缓存")
+                yield cached
+                return
+
+        parts = []
+        agent = self._build_agent()
+        async for chunk in agent.arun(task, stream=True):
+            if chunk.content:
+                parts.append(chunk.content)
+                yield chunk.content
+
+        # 生成被中断时不会执行到这里，缓存中只有完整回答
+        if key is not None:
+            cache[key] = "".join(parts)
+
     async def run(self, task: str, stream: bool = False) -> AsyncGenerator[Dict[str, Any], None]:
         """
         执行任务（流式版本）
@@ -189,24 +256,81 @@ class ReportAgent:
             流式输出的数据块
         """
         if stream:
-            # 流式输出
-            response = ""
-            async for chunk in self.agent.arun(task, stream=True):
-                if chunk.content:
-                    response += chunk.content
+            # 流式输出：只下发增量片段，完整文本由调用方自行累积
+            # 相邻的片段合并为一块，调用方每块发送一帧，减少帧数：
+            # 合并窗口从一块的第一个片段到达开始计时，到期（即使模型暂停、没有新片段）或达到长度上限时立即产出
+            # 模型输出由后台任务读入有界队列：调用方发送上一块时，下一批片段的接收同时进行
+            loop = asyncio.get_running_loop()
+            flush_interval = settings.WS_CHUNK_FLUSH_MS / 1000
+            max_chars = settings.WS_CHUNK_MAX_CHARS
+            buf: List[str] = []
+            buf_len = 0
+            deadline = 0.0
+            queue: asyncio.Queue = asyncio.Queue(maxsize=_RUN_QUEUE_SIZE)
+            producer = asyncio.create_task(self._fill(queue, task))
+            try:
+                while True:
+                    timed_out = False
+                    try:
+                        if buf:
+                            text = await asyncio.wait_for(queue.get(), max(deadline - loop.time(), 0))
+                        else:
+                            text = await queue.get()
+                    except asyncio.TimeoutError:
+                        timed_out = True
+                    if not timed_out:
+                        if text is None:
+                            break
+                        if isinstance(text, Exception):
+                            # 出错前先把已收到的片段发出去 再抛出异常
+                            if buf:
+                                yield {
+                                    "type": "chunk",
+                                    "content": "".join(buf)
+                                }
+                                buf.clear()
+                                buf_len = 0
+                            raise text
+                        if not buf:
+                            deadline = loop.time() + flush_interval
+                        buf.append(text)
+                        buf_len += len(text)
+                        if buf_len < max_chars:
+                            continue
                     yield {
                         "type": "chunk",
-                        "content": chunk.content,
-                        "full_response": response
+                        "content": "".join(buf)
                     }
-            # 最后yield完整响应
+                    buf.clear()
+                    buf_len = 0
+            finally:
+                # 调用方提前停止或出错时 不再继续拉取模型输出
+                producer.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await producer
+            # 完成标记之前先刷出剩余片段
+            if buf:
+                yield {
+                    "type": "chunk",
+                    "content": "".join(buf)
+                }
+            # 最后发送完成标记
             yield {
-                "type": "complete",
-                "content": response
+                "type": "complete"
             }
         else:
             # 非流式输出 - 这里不能用yield，需要另一个方法
             raise ValueError("非流式模式请使用 chat() 方法")
+
+    async def _fill(self, queue: asyncio.Queue, task: Union[str, List]):
+        """run() 的后台生产者：把文本片段放入队列，结束时放入 None，出错时放入异常交给消费方抛出"""
+        try:
+            async for text in self.stream(task):
+                await queue.put(text)
+        except Exception as e:
+            await queue.put(e)
+            return
+        await queue.put(None)
     
    
    
@@ -2,98 +2,157 @@
 WebSocket控制器 - 完整版本
 使用纯数据模型处理事件
 """
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from typing import Dict, Optional
+from fastapi import APIRouter, WebSocket
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, Optional
 from loguru import logger
 from store.conversation_store import ConversationStore
+from store.conversation_registry import ConversationRegistry
+from config.settings import settings
+from models.events import ClientEvent, EventType, client_event_decoder
+from api.ws_sender import MSGPACK_SUBPROTOCOL, WebSocketSender
+from models.transport import encode_event
 
 from agents.report_agent import ReportAgent
 import asyncio
 router = APIRouter()
 
-# ==================== 全局 Agent 引用 ====================
+# 固定内容的下行消息 预先序列化
+_FRAME_PONG = encode_event("pong")
 
-_agent_instance: Optional[ReportAgent] = None
+# ==================== 运行状态 ====================
+
+@dataclass
+class WSState:
+    '''每个 worker 一份的 WebSocket 运行状态：活跃对话与 Agent 引用集中在一个对象上'''
+    # 进程内缓存 + 可选的 Redis 快照（多 worker 部署时共享对话状态）
+    conversations: ConversationRegistry
+    agent: Optional[ReportAgent] = None
+
+
+ws_state = WSState(
+    conversations=ConversationRegistry(
+        settings.REDIS_URL if settings.CONVERSATION_REDIS_ENABLED else None,
+        ttl=settings.CONVERSATION_SNAPSHOT_TTL,
+        maxsize=settings.CONVERSATION_CACHE_SIZE,
+        idle_ttl=settings.CONVERSATION_IDLE_TTL,
+    )
+)
 
 def set_agent(agent: ReportAgent):
     """设置全局 Agent 实例"""
-    print(f"设置全局 Agent 实例: {agent}")
-    global _agent_instance
-    _agent_instance = agent
+    ws_state.agent = agent
     logger.info("🤖 WebSocket 控制器已获取 Agent 引用")
 
 def get_agent() -> ReportAgent:
     """获取全局 Agent 实例"""
-    if _agent_instance is None:
+    if ws_state.agent is None:
         raise RuntimeError("Agent 未初始化")
-    return _agent_instance
+    return ws_state.agent
 
 # ==================== 活跃对话管理 ====================
-active_conversations: Dict[str, ConversationStore] = {}
 
-async def get_or_create_conversation(thread_id: str, websocket: WebSocket = None) -> ConversationStore:
+async def get_or_create_conversation(thread_id: str, sender: WebSocketSender = None) -> ConversationStore:
     """获取或创建对话实例"""
-    if thread_id not in active_conversations:
-        conv = await ConversationStore.create(thread_id, websocket, get_agent())
-        active_conversations[thread_id] = conv
-        logger.info(f"📁 创建/加载对话实例: {thread_id}")
-    else:
-        conv = active_conversations[thread_id]
-    
-    return conv
+    return await ws_state.conversations.get_or_create(thread_id, sender, get_agent())
 
-def remove_conversation(thread_id: str):
-    """移除对话实例"""
-    if thread_id in active_conversations:
-        del active_conversations[thread_id]
-        logger.info(f"📁 对话实例已移除: {thread_id}")
+async def remove_conversation(thread_id: str, sender: WebSocketSender = None):
+    """连接断开 该对话没有其它连接时移除对话实例"""
+    await ws_state.conversations.remove(thread_id, sender)
 
 # ==================== WebSocket 主端点 ====================
 
+async def iter_events(websocket: WebSocket) -> AsyncIterator[ClientEvent]:
+    """逐条接收消息并解码为 ClientEvent（文本帧/二进制帧均支持），客户端断开时迭代结束"""
+    receive = websocket.receive
+    decode = client_event_decoder.decode
+    while True:
+        message = await receive()
+        if message["type"] == "websocket.disconnect":
+            return
+        # msgspec 直接从 bytes 解码为结构体，省去 UTF-8 解码、json.loads 和 dict.get 链
+        yield decode(message.get("bytes") or message.get("text") or b"")
+
+
 @router.websocket("/ws/{thread_id}")
 async def websocket_endpoint(websocket: WebSocket, thread_id: str):
     """WebSocket 主端点"""
     client_host = websocket.client.host if websocket.client else "unknown"
     logger.info(f"📨 WebSocket连接请求: {thread_id} 来自 {client_host}")
-    current_task = None  # 跟踪当前任务
+    worker = None  # 单个消费任务，按顺序处理该连接的消息
+    sender = WebSocketSender(websocket)  # 下行消息统一经过发送器（合并流式chunk）
     try:
-        conv = await get_or_create_conversation(thread_id, websocket)
-        await websocket.accept()
+        # 先完成握手再加载对话：冷启动的加载不拖慢握手
+        # 客户端声明了 MessagePack 子协议时下行帧改用 msgpack 编码，否则使用JSON
+        if MSGPACK_SUBPROTOCOL in websocket.scope.get("subprotocols", ()):
+            await websocket.accept(subprotocol=MSGPACK_SUBPROTOCOL)
+            sender.use_msgpack = True
+        else:
+            await websocket.accept()
+        sender.start()
         logger.info(f"✅ WebSocket连接成功: {thread_id}")
-        while True:
-            data = await websocket.receive_json()
-            data = data.get("data", "").get("content","")
-            
-            # 取消旧任务
-            if current_task and not current_task.done():
-                current_task.cancel()
-                try:
-                    # 给旧任务一点时间清理
-                    await asyncio.wait_for(current_task, timeout=1.0)
-                except (asyncio.CancelledError, asyncio.TimeoutError):
-                    pass
-             # 创建新任务
-            current_task = asyncio.create_task(
-                handle_websocket_message(conv, data)
-            )
-            
-    except WebSocketDisconnect:
+        conv = await get_or_create_conversation(thread_id, sender)
+
+        # 连接确认、状态与历史合并为一帧同步给当前连接（历史较多时其余部分分页下发）
+        for frame in conv.init_frames(settings.WS_HISTORY_PAGE_SIZE):
+            await sender.send_raw(frame)
+
+        in_queue: asyncio.Queue = asyncio.Queue(maxsize=16)
+        worker = asyncio.create_task(message_worker(conv, in_queue))
+        async for event in iter_events(websocket):
+            # lazy：DEBUG 未开启时不做格式化
+            logger.opt(lazy=True).debug("📥 收到消息 {}: {}", lambda: thread_id, lambda: event.type)
+            # 按事件类型查表分发（未知类型按普通消息处理）
+            await _EVENT_HANDLERS.get(event.type, on_message)(sender, conv, event, in_queue)
+
         logger.info(f"🔌 WebSocket断开连接: {thread_id}")
-        remove_conversation(thread_id)
     except Exception as e:
         logger.error(f"❌ WebSocket错误 {thread_id}: {str(e)}")
-        remove_conversation(thread_id)
         try:
             await websocket.close(code=1011, reason=f"服务器错误: {str(e)}")
         except:
             pass
     finally:
-        # 清理最后一个任务
-        if current_task and not current_task.done():
-            current_task.cancel()
+        # 停止消费任务，等它真正退出后再清理（生成中断开时要先保存部分回复）
+        if worker is not None:
+            worker.cancel()
+            try:
+                await worker
+            except asyncio.CancelledError:
+                pass
+        await sender.close()
+        # 任何退出路径（正常断开、异常、任务被取消）都退出广播组，对话不会因漏掉清理而常驻
+        await remove_conversation(thread_id, sender)
 
 # ==================== 消息分发 ====================
 
+async def on_ping(sender: WebSocketSender, conv: ConversationStore, event: ClientEvent, in_queue: asyncio.Queue):
+    """心跳只回最小的pong（不回显客户端数据），只回给当前连接，也不打断生成"""
+    await sender.send_raw(_FRAME_PONG if event.request_id is None else encode_event("pong", request_id=event.request_id))
+
+async def on_cancel(sender: WebSocketSender, conv: ConversationStore, event: ClientEvent, in_queue: asyncio.Queue):
+    """客户端主动取消：立即停止生成（部分回复照常保存），不进入消息队列"""
+    conv.cancel_generation()
+
+async def on_message(sender: WebSocketSender, conv: ConversationStore, event: ClientEvent, in_queue: asyncio.Queue):
+    """新消息打断正在进行的生成，由消费任务接着处理新消息"""
+    conv.cancel_generation()
+    # 队列满时等待（背压），不为每条消息创建任务
+    await in_queue.put(event.data.content)
+
+# 事件类型 → 处理函数：一次字典查找完成分发
+_EVENT_HANDLERS = {
+    EventType.PING: on_ping,
+    EventType.CANCEL: on_cancel,
+    EventType.MESSAGE: on_message,
+}
+
+async def message_worker(conv: ConversationStore, in_queue: asyncio.Queue):
+    """连接级消费任务：从队列中依次取出消息处理"""
+    while True:
+        data = await in_queue.get()
+        await handle_websocket_message(conv, data)
+
 async def handle_websocket_message(
     conv: ConversationStore,
     data: Dict
@@ -103,17 +162,9 @@ async def handle_websocket_message(
         # 处理消息
         await conv.process_message(data)
     except asyncio.CancelledError:
-        # 任务被取消时的清理工作
+        # 消费任务被取消（连接断开）：取消通知已由对话实例发出，这里不再广播给其它连接
         logger.info("handle_websocket_message 被取消")
-        # 可以在这里做清理，比如通知前端
-        try:
-            await conv.websocket.send_json({
-                "type": "cancelled",
-                "message": "您的请求被新指令取代"
-            })
-        except:
-            pass
-        raise  # 重新抛出，让上层知道被取消了
+        raise  # 重新抛出，让消费任务退出
     except Exception as e:
         logger.error(f"处理消息错误: {e}")
 
@@ -128,10 +179,12 @@ async def handle_websocket_message(
 @router.get("/ws/status")
 async def websocket_status():
     """获取WebSocket连接状态"""
+    conversations = ws_state.conversations
     return {
-        "active_conversations": len(active_conversations),
-        "threads": list(active_conversations.keys()),
-        "agent_ready": _agent_instance is not None
+        "active_conversations": len(conversations),
+        "threads": conversations.keys(),
+        "cache": conversations.stats(),
+        "agent_ready": ws_state.agent is not None
     }
 
 
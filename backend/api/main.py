@@ -7,7 +7,9 @@ from fastapi.staticfiles import StaticFiles #添加静态文件服务
 import os
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 import uvicorn
+import asyncio
 from contextlib import asynccontextmanager
 from loguru import logger
 
@@ -16,7 +18,9 @@ from config.settings import settings
 from api.controllers import websocket_controller  # 导入WebSocket控制器（阶段1.2）
 from agents.report_agent import ReportAgent  # 导入ReportAgent
 #配置日志   
-logger.add("logs/app.log", rotation="500 MB", retention="10 days")
+# enqueue：写文件交给后台线程，流式热路径上的日志调用不阻塞事件循环
+# backtrace/diagnose 关闭：异常时不展开变量值（开销大，且可能把用户内容写进日志）
+logger.add("logs/app.log", rotation="500 MB", retention="10 days", enqueue=True, backtrace=False, diagnose=False)
 # 全局 Agent 实例
 agent: ReportAgent = None
 
@@ -28,6 +32,10 @@ async def lifespan(app: FastAPI):
     - 关闭时：关闭数据库连接
     """
     logger.info("🚀 应用启动中...")
+    # 以 uvicorn 命令行/gunicorn 启动时不经过 __main__，在这里检查实际使用的事件循环
+    loop_module = type(asyncio.get_running_loop()).__module__
+    if not loop_module.startswith("uvloop"):
+        logger.warning(f"⚠️ 当前事件循环为 {loop_module}，建议安装 uvloop 并以 --loop uvloop 启动")
     # 启动时
     # await db.connect()
     # await init_db()
@@ -41,6 +49,7 @@ async def lifespan(app: FastAPI):
 
 
     websocket_controller.set_agent(agent)  # 将Agent实例传递给WebSocket控制器
+    app.state.ws_state = websocket_controller.ws_state  # 本 worker 的 WebSocket 运行状态
     logger.info("🤖 Agent 初始化完成")
 
 
@@ -49,15 +58,18 @@ async def lifespan(app: FastAPI):
     
     # 关闭时
     logger.info("👋 应用关闭中...")
+    await websocket_controller.ws_state.conversations.close()
     # await db.close()
     logger.info("✅ 数据库连接已关闭")
+    await logger.complete()  # 等待队列中的日志写完
 
 # 创建FastAPI应用
 app = FastAPI(
     title="AI Report Writing System",
     description="AI驱动的交互式报告写作系统",
     version="0.1.0",
-    lifespan=lifespan  # 添加生命周期管理
+    lifespan=lifespan,  # 添加生命周期管理
+    default_response_class=ORJSONResponse  # 接口响应统一用 orjson 序列化
 )
 
 # 配置CORS
@@ -147,9 +159,30 @@ async def test_database():
     }
 
 if __name__ == "__main__":
+    # 使用 uvloop 替换默认的 asyncio 事件循环（可选依赖，未安装时回退到默认循环）
+    try:
+        import uvloop
+        uvloop.install()
+        loop_impl = "uvloop"
+    except ImportError:
+        logger.warning("⚠️ 未安装 uvloop，使用默认 asyncio 事件循环")
+        loop_impl = "asyncio"
+
+    # HTTP 解析使用 httptools（C实现），未安装时回退到 h11
+    try:
+        import httptools  # noqa: F401
+        http_impl = "httptools"
+    except ImportError:
+        http_impl = "h11"
+
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
         port=settings.PORT,
-        reload=settings.DEBUG  # 开发模式自动重启
+        loop=loop_impl,
+        http=http_impl,
+        ws="websockets",
+        ws_per_message_deflate=settings.WS_PER_MESSAGE_DEFLATE,  # 流式小帧压缩得不偿失，默认关闭 permessage-deflate
+        # 开发模式自动重启；reload 会让 uvicorn 在子进程里重新起服务，生产环境关闭
+        reload=settings.DEBUG and settings.APP_ENV != "production"
     )
\ No newline at end of file
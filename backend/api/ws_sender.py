@@ -0,0 +1,226 @@
+"""
+WebSocket 发送器
+每个连接一个发送器：由单个写任务按顺序发送消息，
+流式 chunk 在短时间窗口内合并为一帧，避免"每个token一帧"
+每帧带连接内递增的 seq 字段，客户端可据此发现丢帧
+客户端协商 MessagePack 子协议时，帧改为 msgpack 编码（默认JSON）
+下行消息的信封编码与对话广播组见 models.transport
+"""
+import asyncio
+import itertools
+from typing import Any, Dict, List, Optional, Tuple
+import msgspec
+import orjson
+from fastapi import WebSocket
+from loguru import logger
+from config.settings import settings
+
+# 队列中的消息种类
+_KIND_CHUNK = "chunk"
+_KIND_RAW = "raw"  # 已序列化好的bytes
+
+# 固定结构消息的序列化模板：信封的前后缀预先编码，只拼接可变字段
+# （orjson.dumps(str) 即合法的JSON字符串字面量；直接拼接bytes，省去每帧解析 % 格式串）
+_CHUNK_HEAD, _CHUNK_TAIL = b'{"type":"chunk","content":', b'}'
+
+# MessagePack 子协议（客户端在 Sec-WebSocket-Protocol 中声明）
+MSGPACK_SUBPROTOCOL = "ai-report.msgpack.v1"
+_msgpack_encode = msgspec.msgpack.Encoder().encode
+_json_decode = msgspec.json.decode
+
+
+class WebSocketSender:
+    '''连接级发送器 所有下行消息都经过这里'''
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        flush_interval: Optional[float] = None,
+        max_batch: Optional[int] = None,
+        max_chars: Optional[int] = None,
+    ):
+        """
+        Args:
+            websocket: 已accept的WebSocket连接
+            flush_interval: chunk合并窗口（秒），从第一个chunk到达开始计时，默认取 WS_CHUNK_FLUSH_MS
+            max_batch: 单帧最多合并的chunk数量，达到后立即发送，默认取 WS_CHUNK_MAX_BATCH
+            max_chars: 单帧合并的文本长度上限，达到后立即发送，默认取 WS_CHUNK_MAX_CHARS
+        """
+        self.websocket = websocket
+        self.flush_interval = flush_interval if flush_interval is not None else settings.WS_CHUNK_FLUSH_MS / 1000
+        self.max_batch = max_batch if max_batch is not None else settings.WS_CHUNK_MAX_BATCH
+        self.max_chars = max_chars if max_chars is not None else settings.WS_CHUNK_MAX_CHARS
+        # 有界队列：客户端读得慢时生产方（agent流）在put处等待，形成背压，避免内存无限增长
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=settings.WS_SEND_QUEUE_SIZE)
+        self._task: Optional[asyncio.Task] = None
+        # 队列持续满超过该时间（秒）视为客户端过载，关闭连接（1013），不让慢客户端无限拖住生成
+        self.put_timeout: float = settings.WS_SEND_TIMEOUT
+        self._overloaded = False
+        # 队列中最后一个尚未被写任务取走的chunk批次（队列满时新chunk并入其中，最多并入 max_chars 个字符）
+        self._tail_chunk: Optional[List[str]] = None
+        self._tail_chars = 0
+        # 下行帧序号（连接内单调递增）
+        self._seq = itertools.count(1)
+        # 预先绑定底层send，写任务直接提交ASGI消息
+        self._asgi_send = websocket.send
+        # 是否使用 MessagePack 编码（握手协商到 MSGPACK_SUBPROTOCOL 时由控制器开启）
+        self.use_msgpack = False
+
+    def start(self):
+        """启动写任务（连接accept之后调用）"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """停止写任务"""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def send_chunk(self, text: str):
+        '''流式文本片段 入队后由写任务合并发送
+        队列满且队尾是chunk时先并入队尾（不阻塞生产方，也不丢内容）；
+        队尾已并满 max_chars 后照常入队等待（背压），客户端持续不读时超时关闭连接
+        '''
+        if self._tail_chunk is not None and self._queue.full() and self._tail_chars < self.max_chars:
+            self._tail_chunk.append(text)
+            self._tail_chars += len(text)
+            return
+        parts = [text]
+        if await self._enqueue(_KIND_CHUNK, parts):
+            self._tail_chunk = parts
+            self._tail_chars = len(text)
+
+    async def send_raw(self, payload: bytes):
+        '''已序列化好的消息（如模块级预编码的固定帧） 排在已入队的chunk之后发送'''
+        await self._put(_KIND_RAW, payload)
+
+    async def _put(self, kind: str, item: Any):
+        """非chunk消息入队 之后的chunk不能再并入它前面的批次"""
+        if await self._enqueue(kind, item):
+            self._tail_chunk = None
+
+    async def _enqueue(self, kind: str, item: Any) -> bool:
+        """
+        入队：有空位时直接放入；队列满时等待（背压），超时则判定客户端过载
+        
+        Returns:
+            是否已入队（连接已过载关闭时丢弃）
+        """
+        if self._overloaded:
+            return False
+        try:
+            self._queue.put_nowait((kind, item))
+            return True
+        except asyncio.QueueFull:
+            pass
+        try:
+            await asyncio.wait_for(self._queue.put((kind, item)), self.put_timeout)
+            return True
+        except asyncio.TimeoutError:
+            await self._close_overloaded()
+            return False
+
+    async def _close_overloaded(self):
+        """客户端长时间不读：停止写任务并以 1013 关闭连接，之后的消息直接丢弃"""
+        self._overloaded = True
+        logger.warning(f"⚠️ WebSocket下行队列持续已满超过 {self.put_timeout}s，关闭连接")
+        await self.close()
+        try:
+            await self.websocket.close(code=1013, reason="客户端接收过慢")
+        except Exception:
+            pass
+
+    def _take(self, item: Any) -> Any:
+        """写任务取走一个chunk批次后 该批次不再接收并入"""
+        if item is self._tail_chunk:
+            self._tail_chunk = None
+        return item
+
+    async def _write(self, payload: bytes):
+        """以二进制帧发送（直接调用底层send，跳过 send_bytes 包装）
+        所有帧都是JSON对象，在结尾的 } 前拼入 seq 字段
+        注意：ASGI消息字典每帧新建，服务器/测试客户端可能在send返回后仍持有它
+        """
+        payload = b'%b,"seq":%d}' % (payload[:-1], next(self._seq))
+        await self._asgi_send({"type": "websocket.send", "bytes": payload})
+
+    async def _write_msgpack(self, message: Dict[str, Any]):
+        """以 MessagePack 编码发送一条消息（同样带 seq 字段）"""
+        payload = _msgpack_encode({**message, "seq": next(self._seq)})
+        await self._asgi_send({"type": "websocket.send", "bytes": payload})
+
+    async def _collect_chunks(self, first: List[str]) -> Tuple[List[str], Optional[Tuple[str, Any]]]:
+        """
+        从队列中收集可合并的chunk
+        
+        先无等待地取出队列里已有的chunk（突发时直接合并，慢速流不被延迟），
+        批次未满时再在合并窗口内等待后续chunk；chunk数量或文本长度达到上限时立即发送
+        
+        Returns:
+            (chunk列表, 收集过程中遇到的普通消息或None)
+        """
+        parts = list(self._take(first))
+        chars = sum(map(len, parts))
+        queue = self._queue
+        while len(parts) < self.max_batch and chars < self.max_chars:
+            try:
+                kind, item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if kind != _KIND_CHUNK:
+                # 完成/错误等消息：立即刷出当前批次，保证顺序
+                return parts, (kind, item)
+            item = self._take(item)
+            parts.extend(item)
+            chars += sum(map(len, item))
+
+        if self.flush_interval <= 0:
+            return parts, None
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(parts) < self.max_batch and chars < self.max_chars:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                kind, item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if kind != _KIND_CHUNK:
+                return parts, (kind, item)
+            item = self._take(item)
+            parts.extend(item)
+            chars += sum(map(len, item))
+        return parts, None
+
+    async def _flush_loop(self):
+        """写任务：逐条发送普通消息，合并连续的chunk"""
+        pending: Optional[Tuple[str, Any]] = None  # 合并chunk时遇到的普通消息，下一轮先发
+        try:
+            while True:
+                kind, item = pending or await self._queue.get()
+                pending = None
+
+                if kind == _KIND_RAW:
+                    # 预编码的JSON帧：msgpack连接上转码（这类帧很少，热路径是下面的chunk）
+                    await (self._write_msgpack(_json_decode(item)) if self.use_msgpack else self._write(item))
+                    continue
+
+                parts, pending = await self._collect_chunks(item)
+                text = "".join(parts)
+                if self.use_msgpack:
+                    await self._write_msgpack({"type": "chunk", "content": text})
+                else:
+                    await self._write(_CHUNK_HEAD + orjson.dumps(text) + _CHUNK_TAIL)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 连接已断开等情况 写任务直接结束
+            logger.debug(f"WebSocket写任务结束: {e}")
+
@@ -31,7 +31,11 @@ class Settings(BaseSettings):
         default="redis://localhost:6379", 
         env="REDIS_URL"
     )
-    
+    CONVERSATION_REDIS_ENABLED: bool = Field(default=False, env="CONVERSATION_REDIS_ENABLED")  # 对话状态是否共享到Redis（多worker部署时开启）
+    CONVERSATION_SNAPSHOT_TTL: int = Field(default=3600, env="CONVERSATION_SNAPSHOT_TTL")  # 断开后对话快照保留时间（秒）
+    CONVERSATION_CACHE_SIZE: int = Field(default=1024, env="CONVERSATION_CACHE_SIZE")  # 进程内强引用的对话数量上限
+    CONVERSATION_IDLE_TTL: int = Field(default=3600, env="CONVERSATION_IDLE_TTL")  # 对话空闲多久（秒）后释放进程内强引用
+
     # MCP服务配置
     MCP_SERVERS: List[dict] = Field(
         default=[
@@ -42,9 +46,21 @@ class Settings(BaseSettings):
         env="MCP_SERVERS"
     )
     
+    # WebSocket流式配置
+    WS_CHUNK_FLUSH_MS: int = Field(default=25, env="WS_CHUNK_FLUSH_MS")  # chunk合并窗口（毫秒），0 表示只合并队列中已有的chunk
+    WS_CHUNK_MAX_BATCH: int = Field(default=8, env="WS_CHUNK_MAX_BATCH")  # 单帧最多合并的chunk数
+    WS_CHUNK_MAX_CHARS: int = Field(default=4096, env="WS_CHUNK_MAX_CHARS")  # 单帧合并的文本长度上限
+    WS_SEND_QUEUE_SIZE: int = Field(default=64, env="WS_SEND_QUEUE_SIZE")  # 下行队列容量（背压阈值）
+    WS_SEND_TIMEOUT: float = Field(default=10.0, env="WS_SEND_TIMEOUT")  # 下行队列持续已满多久（秒）后判定客户端过载并关闭连接
+    WS_HISTORY_PAGE_SIZE: int = Field(default=200, env="WS_HISTORY_PAGE_SIZE")  # 连接时历史消息同步的每页条数
+    WS_PER_MESSAGE_DEFLATE: bool = Field(default=False, env="WS_PER_MESSAGE_DEFLATE")  # 是否协商 permessage-deflate（带宽受限的部署可开启）
+    
     # LLM配置
     OPENAI_API_KEY: Optional[str] = Field(default=None, env="OPENAI_API_KEY")
     DASHSCOPE_API_KEY: Optional[str] = Field(default='sk-1cca217abb40484cb0b982a9c7c9d08b', env="DASHSCOPE_API_KEY")
+    LLM_CACHE_SIZE: int = Field(default=0, env="LLM_CACHE_SIZE")  # 相同提示词回答缓存的条目数，默认 0 不缓存（按需开启）
+    LLM_CACHE_TTL: int = Field(default=86400, env="LLM_CACHE_TTL")  # 回答缓存有效期（秒）
+    AGENT_HISTORY_WINDOW: int = Field(default=10, env="AGENT_HISTORY_WINDOW")  # 每轮交给agent的最近消息条数
     
     # Agno配置
     AGNO_API_KEY: Optional[str] = Field(default=None, env="AGNO_API_KEY")
@@ -52,6 +68,7 @@ class Settings(BaseSettings):
     class Config:
         env_file = ".env"
         case_sensitive = False
+        frozen = True  # 启动时加载一次，之后只读
 
     def get_database_url(self) -> str:
         """获取数据库URL（确保目录存在）"""
@@ -64,8 +81,8 @@ class Settings(BaseSettings):
 # 创建全局配置实例
 settings = Settings()
 
-# 打印配置信息（开发环境）
-if settings.DEBUG:
+# 打印配置信息（直接运行本模块时；导入时不输出，避免密钥进入服务日志）
+if __name__ == "__main__":
     print("=" * 50)
     print("当前配置：")
     print(f"APP_ENV: {settings.APP_ENV}")
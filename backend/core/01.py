@@ -3,14 +3,25 @@
 # 可以使用以下策略
 import asyncio
 import websockets
-import json
+import orjson
 from enum import Enum
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Sequence
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 固定内容的消息 预先序列化（websockets 的 send(str) 发文本帧，客户端按JSON文本解析）
+_FRAME_NO_PENDING = orjson.dumps({"type": "error", "content": "当前没有等待中的决策"}).decode()
+
+# 工作流中的固定决策点：问题与选项不变，问题帧在导入时编码一次
+_QUESTION_OUTLINE = "大纲已生成，是否继续写报告？"
+_OPTIONS_OUTLINE = ("继续", "修改", "中断")
+_FRAME_Q_OUTLINE = orjson.dumps({"type": "question", "content": _QUESTION_OUTLINE, "options": _OPTIONS_OUTLINE}).decode()
+_QUESTION_CHAPTER1 = "第一章已完成，是否继续写第二章？"
+_OPTIONS_CHAPTER1 = ("继续", "修改第一章", "中断")
+_FRAME_Q_CHAPTER1 = orjson.dumps({"type": "question", "content": _QUESTION_CHAPTER1, "options": _OPTIONS_CHAPTER1}).decode()
+
 class State(Enum):
     """定义所有可能的状态"""
     IDLE = "idle"                    # 空闲状态
@@ -20,58 +31,59 @@ class State(Enum):
     INTERRUPTED = "interrupted"       # 被打断
 
 class AgentWorkflow:
-    """状态机工作流"""
+    """状态机工作流
+    上下文字段直接作为实例属性（__slots__），不再放在 context 字典里：
+    属性访问更快，每个会话也少一个字典
+    """
+
+    __slots__ = (
+        "websocket", "state", "step", "history", "pending_question", "current_task",
+        "initial_input", "modification", "interrupt_message", "pending_future",
+    )
     
     def __init__(self, websocket):
         self.websocket = websocket
         self.state = State.IDLE
-        self.context: Dict[str, Any] = {
-            "step": 0,
-            "history": [],
-            "pending_question": None,
-            "current_task": None
-        }
+        self._reset_context(step=0, history=[])
         self.pending_future: Optional[asyncio.Future] = None
+
+    def _reset_context(self, step: int, history: List[str], initial_input: Optional[str] = None):
+        """重置工作流上下文（新任务开始时调用）"""
+        self.step = step
+        self.history = history
+        self.initial_input = initial_input
+        self.pending_question: Optional[Dict[str, Any]] = None
+        self.current_task: Optional[asyncio.Task] = None
+        self.modification: Optional[str] = None
+        self.interrupt_message: Optional[str] = None
         
     async def process_message(self, message: str):
         """处理用户消息 - 状态驱动的核心"""
-        logger.info(f"当前状态: {self.state.value}, 收到消息: {message}")
+        logger.info("当前状态: %s, 收到消息: %s", self.state.value, message)
         
-        # 根据当前状态处理消息
-        if self.state == State.IDLE:
-            # 空闲状态，开始新任务
+        # 根据当前状态处理消息：一次字典查找取代逐个比较的 if/elif 链（已完成状态不处理）
+        handler = self._STATE_HANDLERS.get(self.state)
+        if handler is not None:
+            await handler(self, message)
+
+    async def _resume_or_start(self, message: str):
+        """已打断状态，可以重新开始或继续"""
+        if message == "继续":
+            await self.resume_workflow()
+        else:
             await self.start_workflow(message)
-            
-        elif self.state == State.EXECUTING:
-            # 执行中收到消息 - 这是主动打断！
-            await self.handle_interrupt(message)
-            
-        elif self.state == State.AWAITING_USER:
-            # 等待用户决策 - 处理用户的回复
-            await self.handle_user_response(message)
-            
-        elif self.state == State.INTERRUPTED:
-            # 已打断状态，可以重新开始或继续
-            if message == "继续":
-                await self.resume_workflow()
-            else:
-                await self.start_workflow(message)
     
     async def start_workflow(self, initial_input: str):
         """开始新的工作流"""
         self.state = State.EXECUTING
-        self.context = {
-            "step": 1,
-            "history": [f"开始: {initial_input}"],
-            "initial_input": initial_input
-        }
+        self._reset_context(step=1, history=[f"开始: {initial_input}"], initial_input=initial_input)
         
         # 启动执行任务
-        self.context["current_task"] = asyncio.create_task(
+        self.current_task = asyncio.create_task(
             self.execute_workflow()
         )
         
-        await self.websocket.send_json({
+        await self._send({
             "type": "status",
             "content": f"开始执行任务: {initial_input}"
         })
@@ -89,8 +101,9 @@ class AgentWorkflow:
             
             # ⭐ 决策点：需要询问用户是否继续
             await self.ask_user_decision(
-                question="大纲已生成，是否继续写报告？",
-                options=["继续", "修改", "中断"]
+                question=_QUESTION_OUTLINE,
+                options=_OPTIONS_OUTLINE,
+                preencoded=_FRAME_Q_OUTLINE
             )
             
             # 注意：执行到这里会暂停，不会继续往下走
@@ -102,8 +115,9 @@ class AgentWorkflow:
             
             # 又一个决策点
             await self.ask_user_decision(
-                question="第一章已完成，是否继续写第二章？",
-                options=["继续", "修改第一章", "中断"]
+                question=_QUESTION_CHAPTER1,
+                options=_OPTIONS_CHAPTER1,
+                preencoded=_FRAME_Q_CHAPTER1
             )
             
             # 步骤4：继续执行...
@@ -122,27 +136,32 @@ class AgentWorkflow:
             self.state = State.IDLE
             await self.send_message(f"❌ 错误: {e}", msg_type="error")
     
-    async def ask_user_decision(self, question: str, options: list):
-        """询问用户决策 - 关键方法！"""
+    async def ask_user_decision(self, question: str, options: Sequence[str], preencoded: Optional[str] = None):
+        """询问用户决策 - 关键方法！
+        preencoded: 预先编码好的问题帧文本（固定决策点传入，跳过构建字典和序列化）
+        """
         
         # 保存当前问题到上下文
-        self.context["pending_question"] = {
+        self.pending_question = {
             "question": question,
             "options": options
         }
         
         # 创建 Future，等待用户回复
-        self.pending_future = asyncio.Future()
+        self.pending_future = asyncio.get_running_loop().create_future()
         
         # 改变状态
         self.state = State.AWAITING_USER
         
         # 发送问题给用户
-        await self.websocket.send_json({
-            "type": "question",
-            "content": question,
-            "options": options
-        })
+        if preencoded is not None:
+            await self.websocket.send(preencoded)
+        else:
+            await self._send({
+                "type": "question",
+                "content": question,
+                "options": options
+            })
         
         # ⭐ 关键：这里会暂停，等待用户回复
         # 用户回复后，handle_user_response 会设置 future 的结果
@@ -161,7 +180,7 @@ class AgentWorkflow:
             await self.send_message("请提供修改意见...")
             # 再次等待用户输入修改内容
             modification = await self.wait_for_user_input()
-            self.context["modification"] = modification
+            self.modification = modification
             # 处理修改...
         elif user_response == "修改第一章":
             # 特定修改指令
@@ -173,7 +192,7 @@ class AgentWorkflow:
     
     async def wait_for_user_input(self) -> str:
         """等待用户输入（通用等待方法）"""
-        self.pending_future = asyncio.Future()
+        self.pending_future = asyncio.get_running_loop().create_future()
         self.state = State.AWAITING_USER
         return await self.pending_future
     
@@ -189,23 +208,20 @@ class AgentWorkflow:
         else:
             # 没有等待中的 Future，说明状态异常
             logger.warning(f"收到消息但没有等待中的决策: {response}")
-            await self.websocket.send_json({
-                "type": "error",
-                "content": "当前没有等待中的决策"
-            })
+            await self.websocket.send(_FRAME_NO_PENDING)
     
     async def handle_interrupt(self, message: str):
         """处理主动打断"""
         logger.info(f"用户主动打断: {message}")
         
         # 取消当前执行的任务
-        if self.context.get("current_task"):
-            self.context["current_task"].cancel()
+        if self.current_task:
+            self.current_task.cancel()
         
         self.state = State.INTERRUPTED
-        self.context["interrupt_message"] = message
+        self.interrupt_message = message
         
-        await self.websocket.send_json({
+        await self._send({
             "type": "interrupt",
             "content": f"已打断，您的意见: {message}，请输入'继续'恢复或发送新指令"
         })
@@ -214,12 +230,12 @@ class AgentWorkflow:
         """恢复被打断的工作流"""
         self.state = State.EXECUTING
         # 可以重新开始或从断点继续
-        await self.websocket.send_json({
+        await self._send({
             "type": "status",
             "content": "恢复执行..."
         })
         # 重新创建执行任务
-        self.context["current_task"] = asyncio.create_task(
+        self.current_task = asyncio.create_task(
             self.execute_workflow()
         )
     
@@ -230,13 +246,26 @@ class AgentWorkflow:
         await asyncio.sleep(1)
         await self.send_message(f"第{chapter}章修改完成")
     
+    # ==================== 状态分发表 ====================
+    # 空闲 -- 开始新任务；执行中 -- 主动打断；等待用户决策 -- 处理用户的回复；已打断 -- 继续或重新开始
+    _STATE_HANDLERS = {
+        State.IDLE: start_workflow,
+        State.EXECUTING: handle_interrupt,
+        State.AWAITING_USER: handle_user_response,
+        State.INTERRUPTED: _resume_or_start,
+    }
+
     async def send_message(self, content: str, msg_type: str = "info"):
         """发送消息给客户端"""
-        await self.websocket.send_json({
+        await self._send({
             "type": msg_type,
             "content": content
         })
 
+    async def _send(self, payload: Dict[str, Any]):
+        """orjson 序列化后以文本帧发送（所有下行消息都经过这里；send(bytes) 会发成二进制帧）"""
+        await self.websocket.send(orjson.dumps(payload).decode())
+
 # WebSocket 服务器
 async def websocket_handler(websocket, path):
     """处理 WebSocket 连接"""
@@ -244,7 +273,7 @@ async def websocket_handler(websocket, path):
     
     try:
         async for message in websocket:
-            data = json.loads(message)
+            data = orjson.loads(message)
             content = data.get("content", "")
             
             # 所有消息都交给 workflow 处理
@@ -262,6 +291,12 @@ async def main():
         await asyncio.Future()  # 永久运行
 
 if __name__ == "__main__":
+    # 使用 uvloop 替换默认的 asyncio 事件循环（可选依赖，未安装时回退到默认循环）
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        logger.warning("未安装 uvloop，使用默认 asyncio 事件循环")
     asyncio.run(main())
 
 
@@ -0,0 +1,34 @@
+"""
+WebSocket 事件模型
+客户端上行消息的结构定义（msgspec.Struct：bytes→结构体 在C层一次完成解码与校验）
+"""
+from enum import Enum
+from typing import Optional
+import msgspec
+
+
+class EventType(str, Enum):
+    """客户端上行事件类型
+    str 枚举与对应字符串相等且哈希相同：解码出的 type 字符串可直接在以枚举为键的分发表中查找
+    """
+    MESSAGE = "message"
+    PING = "ping"
+    CANCEL = "cancel"
+
+
+class MessageEventData(msgspec.Struct):
+    """用户消息数据"""
+    content: str = ""
+
+
+class ClientEvent(msgspec.Struct):
+    """客户端上行事件
+    格式: {"type": "message", "data": {"content": "..."}, "request_id": "req_xxx"}
+    """
+    type: str = EventType.MESSAGE.value  # EventType 的取值；未知类型按普通消息处理
+    data: MessageEventData = msgspec.field(default_factory=MessageEventData)
+    request_id: Optional[str] = None
+
+
+# 复用解码器（避免每条消息重新构建类型信息）
+client_event_decoder = msgspec.json.Decoder(ClientEvent)
@@ -0,0 +1,69 @@
+"""
+下行消息传输模型
+下行消息的统一信封编码，以及对话广播组（同一对话的所有连接）
+存储层与 API 层都依赖这里：对话实例只面向广播组发送，不关心具体连接如何成帧
+"""
+from typing import Any, Protocol, Set
+import orjson
+
+# 固定结构消息的序列化模板：信封的前后缀预先编码，只拼接可变字段
+_ERROR_HEAD, _ERROR_TAIL = b'{"type":"error","message":', b'}'
+
+
+def encode_event(event_type: Any, **fields: Any) -> bytes:
+    """
+    序列化一条下行消息：统一的 {"type": ..., **fields} 信封
+    所有下行消息都经过这里构建，序列化方式只在一处维护
+
+    Args:
+        event_type: 消息类型（字符串或枚举）
+        **fields: 消息字段，如 content / message
+    """
+    return orjson.dumps({"type": getattr(event_type, "value", event_type), **fields}, default=str)
+
+
+def encode_error(message: str) -> bytes:
+    """序列化错误消息（使用模板，只编码 message 字段）"""
+    return _ERROR_HEAD + orjson.dumps(message) + _ERROR_TAIL
+
+
+class FrameSender(Protocol):
+    '''单个连接的发送器需要提供的接口（由 api.ws_sender.WebSocketSender 实现）'''
+
+    async def send_chunk(self, text: str) -> None: ...
+
+    async def send_raw(self, payload: bytes) -> None: ...
+
+
+class WebSocketGroup:
+    '''同一对话（thread_id）的所有连接 下行消息广播到每个连接
+
+    多个标签页/监控端可以同时观察同一对话；普通消息只序列化一次，
+    再把同一份bytes交给每个连接的发送器
+    '''
+
+    def __init__(self):
+        self._senders: Set[FrameSender] = set()
+
+    def add(self, sender: FrameSender):
+        self._senders.add(sender)
+
+    def discard(self, sender: FrameSender):
+        self._senders.discard(sender)
+
+    def __len__(self) -> int:
+        return len(self._senders)
+
+    async def send_chunk(self, text: str):
+        '''流式文本片段 由各连接的发送器分别合并成帧'''
+        for sender in tuple(self._senders):
+            await sender.send_chunk(text)
+
+    async def send_raw(self, payload: bytes):
+        '''已序列化好的消息 广播给所有连接'''
+        for sender in tuple(self._senders):
+            await sender.send_raw(payload)
+
+    async def send_error(self, message: str):
+        '''错误消息 使用模板序列化后广播'''
+        await self.send_raw(encode_error(message))
@@ -19,6 +19,7 @@ class AppStore {
     };
     
     #subscribers = [];
+    #decoder = new TextDecoder('utf-8');
     
     // ===== 构造函数 =====
     constructor() {
@@ -105,6 +106,8 @@ class AppStore {
         
         const wsUrl = `ws://${window.location.host}/ws/${this.#state.threadId}`;
         const ws = new WebSocket(wsUrl);
+        // 服务端以二进制帧（UTF-8 JSON）下发消息
+        ws.binaryType = 'arraybuffer';
         
         ws.onopen = () => {
             this.setState({ 
@@ -134,7 +137,10 @@ class AppStore {
         ws.onmessage = (event) => {
             try {
                 
-                const data = JSON.parse(event.data);
+                const raw = typeof event.data === 'string'
+                    ? event.data
+                    : this.#decoder.decode(event.data);
+                const data = JSON.parse(raw);
                 console.log("收到消息...001",data);
                 
                 this.#dispatch(data);
@@ -234,6 +240,14 @@ class AppStore {
         if (eventData.type === 'history' && eventData.messages) {
             // 历史消息
             this.setState({ messages: eventData.messages });
+        } else if (eventData.type === 'init') {
+            // 连接初始化：连接确认 + 第一页历史（其余历史以 history_page 追加）
+            this.setState({ messages: eventData.history || [] });
+        } else if (eventData.type === 'history_page') {
+            // 分页历史消息：追加在已有消息之后
+            this.setState(prev => ({
+                messages: [...prev.messages, ...eventData.messages]
+            }));
         } else if (eventData.type === 'state') {
             // 状态同步
             const updates = {
@@ -0,0 +1,202 @@
+"""
+活跃对话注册表
+进程内缓存活跃的 ConversationStore；开启 Redis 后同时保存对话快照，
+多个 worker / 多副本之间共享对话状态，断线重连或进程重启后可恢复
+"""
+import asyncio
+import weakref
+from typing import Callable, Dict, List, Optional, Set
+from weakref import WeakValueDictionary
+import orjson
+from cachetools import TTLCache
+from loguru import logger
+from models.transport import FrameSender, WebSocketGroup
+from store.conversation_store import ConversationStore
+
+
+class _EvictingCache(TTLCache):
+    '''超出容量（LRU淘汰）或空闲超时都会回调的缓存'''
+
+    def __init__(self, maxsize: int, ttl: float, on_evict: Callable[[str, ConversationStore, bool], None]):
+        super().__init__(maxsize, ttl)
+        self._on_evict = on_evict
+
+    def popitem(self):
+        key, value = super().popitem()
+        self._on_evict(key, value, False)
+        return key, value
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        for key, value in expired:
+            self._on_evict(key, value, True)
+        return expired
+
+
+class ConversationRegistry:
+    '''活跃对话注册表 本地缓存在前，Redis 快照在后
+    
+    本地缓存分两层：LRU+TTL 强引用最近使用的 maxsize 个对话（空闲超过 idle_ttl 的也会释放）；
+    弱引用字典记录所有仍在使用的对话。
+    异常路径漏掉 remove 时，被挤出缓存且不再被连接引用的对话会被回收，内存不会无限增长
+    '''
+
+    def __init__(
+        self,
+        redis_url: Optional[str] = None,
+        ttl: int = 3600,
+        key_prefix: str = "conv:",
+        maxsize: int = 1024,
+        idle_ttl: float = 3600,
+    ):
+        """
+        Args:
+            redis_url: Redis 地址，为空时只使用进程内缓存
+            ttl: 连接断开后快照在 Redis 中的保留时间（秒），期间重连可恢复对话
+            key_prefix: Redis 键前缀
+            maxsize: 强引用保留的对话数量上限
+            idle_ttl: 对话空闲多久（秒，从最后一次获取开始计）后释放强引用
+        """
+        self._strong = _EvictingCache(maxsize, idle_ttl, self._on_evict)
+        # 统计：容量淘汰 / 空闲过期 / 实例被回收 的次数
+        self._stats = {"evicted": 0, "expired": 0, "collected": 0}
+        self._weak: WeakValueDictionary = WeakValueDictionary()
+        self._background: Set[asyncio.Task] = set()  # 淘汰时的快照写入任务（持有引用防止被回收）
+        self._loading: Dict[str, asyncio.Future] = {}  # 正在加载的对话：同一 thread_id 的并发创建共享一次加载
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+        self._redis = None
+        if redis_url:
+            try:
+                import redis.asyncio as aioredis
+                self._redis = aioredis.from_url(redis_url)
+                logger.info(f"🗄️ 对话注册表使用 Redis: {redis_url}")
+            except ImportError:
+                logger.warning("⚠️ 未安装 redis，对话注册表仅使用进程内缓存")
+
+    def __len__(self) -> int:
+        return len(self._weak)
+
+    def keys(self) -> List[str]:
+        return list(self._weak.keys())
+
+    def stats(self) -> Dict[str, int]:
+        """缓存统计（状态接口使用）"""
+        self._strong.expire()
+        return {"cached": len(self._strong), **self._stats}
+
+    def _key(self, thread_id: str) -> str:
+        return self.key_prefix + thread_id
+
+    async def get_or_create(self, thread_id: str, sender: Optional[FrameSender], agent) -> ConversationStore:
+        """获取或创建对话实例：本地缓存 → Redis 快照 → 新建
+        同一 thread_id 的多个连接共享一个实例，sender 加入该对话的广播组
+        """
+        conv = self._strong.get(thread_id)
+        if conv is None:
+            conv = self._weak.get(thread_id)
+        if conv is None:
+            loading = self._loading.get(thread_id)
+            if loading is not None:
+                # 重连风暴等场景：等待正在进行的加载，不重复读取
+                conv = await asyncio.shield(loading)
+        if conv is not None:
+            self._strong[thread_id] = conv  # 刷新LRU位置
+            if sender is not None:
+                conv.websocket.add(sender)
+            return conv
+
+        group = WebSocketGroup()
+        if sender is not None:
+            group.add(sender)
+        future = asyncio.get_running_loop().create_future()
+        self._loading[thread_id] = future
+        try:
+            conv = await self._load(thread_id, group, agent)
+            future.set_result(conv)
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 标记异常已读取：没有并发等待者时不输出告警
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            self._loading.pop(thread_id, None)
+        return conv
+
+    async def _load(self, thread_id: str, group: WebSocketGroup, agent) -> ConversationStore:
+        """加载对话实例并放入本地缓存：Redis 快照优先，未命中时再从数据库加载"""
+        snapshot = await self._load_snapshot(thread_id)
+        if snapshot is not None:
+            # 命中快照：直接恢复，不再读数据库
+            conv = ConversationStore(thread_id, group, agent)
+            conv.restore(snapshot)
+            logger.info(f"📁 从 Redis 恢复对话实例: {thread_id}")
+        else:
+            conv = await ConversationStore.create(thread_id, group, agent)
+            logger.info(f"📁 创建/加载对话实例: {thread_id}")
+        if self._redis is not None:
+            # 每轮消息保存后同时写穿到 Redis，其它 worker 随时可以恢复最新的对话
+            conv.on_saved = self._save_snapshot
+        self._strong[thread_id] = conv
+        self._weak[thread_id] = conv
+        weakref.finalize(conv, self._on_collected)
+        return conv
+
+    async def remove(self, thread_id: str, sender: Optional[FrameSender] = None):
+        """连接断开：sender 退出广播组；最后一个连接断开时移除本地对话实例，
+        快照写回 Redis 并设置过期时间（不直接删除，便于重连恢复）
+        """
+        conv = self._weak.get(thread_id)
+        if conv is None:
+            return
+        if sender is not None:
+            conv.websocket.discard(sender)
+            if len(conv.websocket):
+                return  # 还有其它连接在观察该对话
+        self._weak.pop(thread_id, None)
+        self._strong.pop(thread_id, None)
+        await conv.flush()
+        await self._save_snapshot(thread_id, conv)
+        logger.info(f"📁 对话实例已移除: {thread_id}")
+
+    def _on_collected(self):
+        self._stats["collected"] += 1
+
+    def _on_evict(self, thread_id: str, conv: ConversationStore, expired: bool):
+        """对话被挤出缓存或空闲过期：把快照写回 Redis（仍被连接引用的对话继续留在弱引用字典中）"""
+        self._stats["expired" if expired else "evicted"] += 1
+        if self._redis is None:
+            return
+        task = asyncio.get_running_loop().create_task(self._save_snapshot(thread_id, conv))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def close(self):
+        """写完所有对话的待保存消息，关闭 Redis 连接（应用关闭时调用）"""
+        for conv in list(self._weak.values()):
+            await conv.flush()
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+    # ==================== Redis 快照 ====================
+
+    async def _load_snapshot(self, thread_id: str) -> Optional[dict]:
+        if self._redis is None:
+            return None
+        try:
+            raw = await self._redis.get(self._key(thread_id))
+        except Exception as e:
+            # Redis 不可用时退化为进程内缓存 不影响连接
+            logger.warning(f"⚠️ 读取对话快照失败 {thread_id}: {e}")
+            return None
+        return orjson.loads(raw) if raw else None
+
+    async def _save_snapshot(self, thread_id: str, conv: ConversationStore):
+        if self._redis is None:
+            return
+        try:
+            await self._redis.set(self._key(thread_id), conv.snapshot_bytes(), ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"⚠️ 保存对话快照失败 {thread_id}: {e}")
@@ -1,9 +1,40 @@
-from fastapi import WebSocket
 import asyncio
-from typing import Optional, List, Dict, Any
+import re
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional, Awaitable, Callable, Iterator, List, Dict, Any, Tuple
 from enum import Enum
 from loguru import logger
 from datetime import datetime,timezone
+import orjson
+from models.transport import WebSocketGroup, encode_event
+from config.settings import settings
+
+# 固定内容的下行消息 预先序列化
+_FRAME_CANCELLED = encode_event("cancelled", message="生成被中断")
+_FRAME_INTERRUPT = encode_event("interrupt", content="已中断当前生成")
+
+# 打断指令关键词（后期可以交给ai来识别意图）：导入时构建多模式匹配器，一次扫描完成所有关键词的包含匹配
+_STOP_WORDS = ("停止", "中断", "停下")
+try:
+    import ahocorasick  # 可选依赖 pyahocorasick，关键词变多时优势明显
+except ImportError:
+    ahocorasick = None
+
+if ahocorasick is not None:
+    _STOP_AUTOMATON = ahocorasick.Automaton()
+    for _word in _STOP_WORDS:
+        _STOP_AUTOMATON.add_word(_word, _word)
+    _STOP_AUTOMATON.make_automaton()
+
+    def _contains_stop_word(message: str) -> bool:
+        return next(_STOP_AUTOMATON.iter(message), None) is not None
+else:
+    # 未安装时使用预编译正则，同样由C层一次扫描
+    _STOP_RE = re.compile("|".join(map(re.escape, _STOP_WORDS)))
+
+    def _contains_stop_word(message: str) -> bool:
+        return _STOP_RE.search(message) is not None
 
 
 class ConversationState(Enum):
@@ -18,17 +49,28 @@ class ConversationStore:
     '''对话类 每个对话独立实例'''
 
     @classmethod
-    async def create(cls, thread_id: str, websocket: Optional[WebSocket] = None, agent=None) -> "ConversationStore":
+    async def create(cls, thread_id: str, websocket: Optional[WebSocketGroup] = None, agent=None) -> "ConversationStore":
         """异步工厂方法：创建实例并加载数据"""
         instance = cls(thread_id, websocket, agent)
         await instance._load_from_db()
         return instance
     
-    def __init__(self, thread_id:str, websocket:WebSocket,agent=None):
+    def __init__(self, thread_id:str, websocket:WebSocketGroup,agent=None):
         self.thread_id = thread_id
-        self.websocket = websocket
+        self.websocket = websocket  # 该对话的所有连接，下行消息广播
         self.agent = agent
         self.history = []
+        self._history_json: Optional[bytes] = None  # 历史消息的序列化缓存（追加消息时失效）
+        # 连接初始化帧的缓存：((状态, 每页条数), 帧列表)，历史变化时失效，重连时不必重新序列化
+        self._init_frames: Optional[Tuple[Tuple[ConversationState, int], Tuple[bytes, ...]]] = None
+        # 交给agent的最近N条消息（只含 role/content），追加消息时同步维护，不必每轮重新切片构建
+        self._agent_window: deque = deque(maxlen=settings.AGENT_HISTORY_WINDOW)
+        self._unsaved: List[Dict] = []  # 尚未写入数据库的消息，_save 时批量写入
+        self._save_lock = asyncio.Lock()
+        # 后台写入任务（write-behind）：修改后立即返回，写库在后台批量进行，写完即退出
+        self._persist_task: Optional[asyncio.Task] = None
+        # 保存完成后的回调（如写穿到 Redis 快照），参数为 (thread_id, 对话实例)
+        self.on_saved: Optional[Callable[[str, "ConversationStore"], Awaitable[None]]] = None
         self.full_response = ""
         self.current_task : Optional[asyncio.Task] = None
         self.state = ConversationState.IDLE
@@ -38,57 +80,99 @@ class ConversationStore:
 
     async def _load_from_db(self):
         """从数据库加载数据到内存"""
-        print(f"\n📚 [ConversationStore._load_from_db] 开始加载对话 {self.thread_id}")
+        logger.opt(lazy=True).debug("📚 开始加载对话 {}", lambda: self.thread_id)
         
         # 1. 加载对话历史
         history = None
         if history:
             self.history = history 
-            print(f"   ✅ 找到现有对话: {self.thread_id}")
-            print(f"历史消息数量: {len(self.history)}")
+            logger.opt(lazy=True).debug("✅ 找到现有对话: {}，历史消息数量: {}", lambda: self.thread_id, lambda: len(self.history))
             
         else:
             pass
 
+    def snapshot_bytes(self) -> bytes:
+        """导出序列化好的对话快照（用于跨进程共享/重连恢复）
+        历史消息只在变化后重新序列化一次，状态字段每次拼接
+        """
+        if self._history_json is None:
+            self._history_json = orjson.dumps(self.history)
+        return b'{"history":%b,"state":%b}' % (self._history_json, orjson.dumps(self.state.value))
+
+    def restore(self, snapshot: Dict[str, Any]):
+        """从快照恢复对话 生成任务无法跨进程恢复，执行中的对话按已打断处理"""
+        self.history = snapshot.get("history") or []
+        self._history_json = None
+        self._init_frames = None
+        self._agent_window.clear()
+        self._agent_window.extend({"role": m["role"], "content": m["content"]} for m in self.history[-self._agent_window.maxlen:])
+        state = ConversationState(snapshot.get("state", ConversationState.IDLE.value))
+        self.state = ConversationState.INTERRUPTED if state == ConversationState.EXECUTING else state
+
+    def init_frames(self, page_size: int) -> Tuple[bytes, ...]:
+        """
+        连接初始化帧：一帧内包含连接确认、对话状态和第一页历史；
+        历史超过一页时，其余部分按页逐帧下发（避免一次发送巨大的消息）
+        历史与状态都没变时直接复用上次序列化的结果
+        
+        Args:
+            page_size: 每页历史消息数
+        
+        Returns:
+            序列化好的 sync/init 帧，以及后续的 sync/history_page 帧（最后一页 done=True）
+        """
+        key = (self.state, page_size)
+        cached = self._init_frames
+        if cached is None or cached[0] != key:
+            cached = self._init_frames = (key, tuple(self._build_init_frames(page_size)))
+        return cached[1]
+
+    def _build_init_frames(self, page_size: int) -> Iterator[bytes]:
+        thread_id = self.thread_id
+        history = self.history
+        total = len(history)
+        yield encode_event("sync", content={
+            "type": "init",
+            "thread_id": thread_id,
+            "connected": True,
+            "state": self.state.value,
+            "history": history[:page_size],
+            "history_total": total,
+        })
+        for page, start in enumerate(range(page_size, total, page_size), 1):
+            yield encode_event(
+                "sync",
+                content={"type": "history_page", "messages": history[start:start + page_size], "page": page, "done": start + page_size >= total},
+            )
+
     async def process_message(self,message:str):
         '''处理用户消息 -状态驱动的核心'''
-        logger.info(f"当前状态:{self.state.value}, 收到消息:{message}")
+        # 每条消息都会经过这里：lazy模式下仅在DEBUG级别开启时才格式化
+        logger.opt(lazy=True).debug("当前状态:{}, 收到消息:{}", lambda: self.state.value, lambda: message)
 
-        # 根据当前状态处理消息
-        if self.state == ConversationState.IDLE or self.state == ConversationState.INTERRUPTED:
-            # 空闲状态 开始新任务
-            print("001...",message)
-            self.state = ConversationState.EXECUTING
-            await self.process(message)
-        elif self.state == ConversationState.EXECUTING:
-            # 执行中收到消息 -- 这里有可能主动打断
-            await self.handle_interrupt(message)
-        elif self.state == ConversationState.AWAITING_USER:
-            # 等待用户决策-- 处理用户的回复
-            await self.handle_user_response(message)
-        else:
-            # 已打断状态 可以重新开始或者继续
-            self.state = ConversationState.EXECUTING
-            await self.process(message)
+        # 根据当前状态处理消息：一次字典查找取代逐个比较的 if/elif 链
+        handler = self._STATE_HANDLERS[self.state]
+        await handler(self, message)
 
-        pass
+    async def _start_process(self, message:str):
+        '''空闲/已打断/已完成状态 开始新任务'''
+        self.state = ConversationState.EXECUTING
+        await self.process(message)
    
     async def handle_interrupt(self, message:str):
         '''处理主动打断'''
-        logger.info(f"用户主动打断:{message}")
+        logger.opt(lazy=True).debug("用户主动打断:{}", lambda: message)
 
-        if self.current_task and not self.current_task.done():
+        task = self.current_task
+        if task is not None and not task.done():
             # 说明ai正在执行时 用户输出了新的消息 需要先取消之前的任务 并且根据用户信息决定如何处理 用户可能输出的是一些对ai的建议 
             # 也可能是停止当前ai的行为
             self._cancel_event.set()
             # 取消任务
-            self.current_task.cancel()
+            task.cancel()
             try:
-                #  等待任务真正取消（带超时）
-                await asyncio.wait_for(self.current_task, timeout=2.0)
-            except (asyncio.TimeoutError, asyncio.CancelledError):
-                # 超时或已取消，都没关系
-                pass
+                # 等待任务真正结束：asyncio.wait 不抛出任务的异常，也不需要额外的超时计时器
+                await asyncio.wait((task,))
             finally:
                 self._cancel_event.clear()
                 self.current_task = None
@@ -96,8 +180,7 @@ class ConversationStore:
 
 
         # 第二步： 检查是否是纯打断指令 (后期可以交给ai来识别意图 开发阶段先实现功能)
-        stop_words = ["停止", "中断", "停下"]
-        is_pure_interrupt = any(word in message for word in stop_words)
+        is_pure_interrupt = _contains_stop_word(message)
 
         if is_pure_interrupt:
             await self.interupt_process()
@@ -107,6 +190,13 @@ class ConversationStore:
             self.state = ConversationState.EXECUTING
             await self.process(message)
 
+    def cancel_generation(self) -> bool:
+        '''取消正在进行的生成任务（收到新消息时调用） 返回是否有任务被取消'''
+        if self.current_task and not self.current_task.done():
+            self.current_task.cancel()
+            return True
+        return False
+
     async def handle_user_response(self, response:str):
         '''等待用户决策-- 处理用户的回复'''
         pass
@@ -124,14 +214,13 @@ class ConversationStore:
                 "timestamp": datetime.now(timezone.utc).isoformat()
             }
 
-            self.history.append(user_content)
-            print("003...",user_content)
-            await self._save(user_content)
-            print("003...",user_content)
+            # 用户消息立即交给后台写入（生成出错时也不会只留在内存里）
+            async with self.mutate():
+                self._append_history(user_content)
 
             # 获取当前输入和历史信息 交给agent进行处理
             prompt = await self._getPrompt(user_input)
-            print("ai提示词:",prompt)
+            logger.opt(lazy=True).debug("ai提示词: {}", lambda: prompt)
             self.current_task = asyncio.create_task(
                 self._generate_response(prompt)
             )
@@ -140,100 +229,147 @@ class ConversationStore:
         except asyncio.CancelledError:
             # 任务被取消 这是正常的
             logger.info("任务被中断取消")
+            # 已生成的部分回复照样保存，不随取消丢失
+            await self._save_partial_response()
             # 发送取消通知（可选）
-            await self.websocket.send_json({
-                "type": "cancelled",
-                "message": "生成被中断"
-            })
+            await self.websocket.send_raw(_FRAME_CANCELLED)
+            # 只吞掉内部生成任务的取消；调用方任务本身被取消（如连接断开）时继续抛出，让它正常退出
+            if asyncio.current_task().cancelling():
+                raise
         except Exception as e:
             pass
 
     async def _generate_response(self, prompt:List):
         '''agent执行过程'''
         try:
-            async for chunk in self.agent.run(prompt, stream=True):
+            # 直接消费agent的文本流（少一层字典包装）
+            async for text in self.agent.stream(prompt):
                 #每次检查是否被打断
                 if self._cancel_event.is_set():
                     logger.info("检测到取消标志，停止生成")
                     break
-                chunk_type = chunk.get("type", "chunk")
-                if chunk_type == "chunk":
-                    print(chunk)
-                    text = chunk.get("content", "")
-                    # print(isinstance(text, str))
-                    # print(text.encode('utf-8').decode('unicode-escape'))
-                    # print("6666...")
-                    self.full_response += text
+                self.full_response += text
+                
+                # 发送给前端（由发送器合并后成帧）
+                await self.websocket.send_chunk(text)
+            else:
+                # 生成完成
+                if not self._cancel_event.is_set():
+                    # 保存助手回复
+                    assistant_content = {
+                        "role": "assistant",
+                        "content": self.full_response,
+                        "timestamp": datetime.now(timezone.utc).isoformat()
+                    }
+                    async with self.mutate():
+                        self._append_history(assistant_content)
                     
-                    # 发送给前端
-                    await self.websocket.send_json({
-                        "type": "chunk",
-                        "content": text
-                    })
+                    # 发送完成信号
+                    # await self.websocket.send_json({
+                    #     "type": "complete",
+                    #     "content": self.full_response
+                    # })
                     
-                elif chunk_type in ["done", "complete"]:
-                    # 生成完成
-                    if not self._cancel_event.is_set():
-                        # 保存助手回复
-                        assistant_content = {
-                            "role": "assistant",
-                            "content": self.full_response,
-                            "timestamp": datetime.now(timezone.utc).isoformat()
-                        }
-                        self.history.append(assistant_content)
-                        await self._save(assistant_content)
-                        
-                        # 发送完成信号
-                        # await self.websocket.send_json({
-                        #     "type": "complete",
-                        #     "content": self.full_response
-                        # })
-                        
-                        self.full_response = ""
+                    self.full_response = ""
         except asyncio.CancelledError:
             # 任务被外部取消
             raise # 重新抛出，让上层处理
         except Exception as e:
             logger.error(f"生成错误: {e}")
-            await self.websocket.send_json({
-                "type": "error",
-                "message": str(e)
-            })
+            await self.websocket.send_error(str(e))
         finally:
             # 清理任务引用（如果当前任务就是自己）
             if self.current_task == asyncio.current_task():
                 self.current_task = None
 
 
-    async def interupt_process(self):
-        print("已中断当前生成...")
-        if self.full_response:
-            assistant_content = {"role": "assistant", "content": self.full_response, "timestamp": datetime.now(timezone.utc).isoformat()}
-
-            self.history.append(assistant_content)
-            await self._save(assistant_content)  # 保存对话状态到数据库 数据库方面以后再处理        
-            self.full_response= ""
+    async def _save_partial_response(self):
+        '''保存被取消/中断时已生成的部分回复，并清空缓冲（避免拼到下一轮回复前面）'''
+        async with self.mutate():
+            if self.full_response:
+                assistant_content = {"role": "assistant", "content": self.full_response, "timestamp": datetime.now(timezone.utc).isoformat()}
+                self._append_history(assistant_content)
+                self.full_response= ""
 
+    async def interupt_process(self):
+        await self._save_partial_response()
         # 改变状态
         self.state = ConversationState.INTERRUPTED
-        await self.websocket.send_json({
-                "type":"interrupt",
-                "content": "已中断当前生成"
-        })
-        print("中断结束....")
+        await self.websocket.send_raw(_FRAME_INTERRUPT)
+        logger.info("已中断当前生成")
         pass
 
+    # ==================== 状态分发表 ====================
+    # 执行中收到消息 -- 这里有可能主动打断；等待用户决策 -- 处理用户的回复；其余状态开始新任务
+    _STATE_HANDLERS = {
+        ConversationState.IDLE: _start_process,
+        ConversationState.INTERRUPTED: _start_process,
+        ConversationState.COMPLETED: _start_process,
+        ConversationState.EXECUTING: handle_interrupt,
+        ConversationState.AWAITING_USER: handle_user_response,
+    }
+
+    def _append_history(self, content: Dict):
+        """追加历史消息 同时使序列化缓存失效（消息进入待保存列表）"""
+        self.history.append(content)
+        self._agent_window.append({"role": content["role"], "content": content["content"]})
+        self._unsaved.append(content)
+        self._history_json = None
+        self._init_frames = None
+
+    @asynccontextmanager
+    async def mutate(self):
+        '''批量修改对话：块内的所有修改在退出时只保存一次，并发的修改依次进行
+        内存中的修改同步完成，保存交给后台写入任务，不阻塞调用方（如完成信号的发送）
+        '''
+        async with self._save_lock:
+            yield
+            self._schedule_save()
+
     async def _getPrompt(self, user_input:str):
         '''根据当前输入以及历史信息 获取提示词
             实际项目中 看是否需要专门的agent来总结
         '''
-        # 只返回历史 不修改
-        return self.history.copy()
+        # 最近N条消息的副本（agent只需要 role/content），不修改历史
+        return list(self._agent_window)
 
-    async def _save(self,content:Dict):
-        # 保存到数据库
-        print("保存到数据库...")
-        pass
-            
-        
+    def _schedule_save(self):
+        '''有待保存的消息时启动后台写入任务（任务已在运行时由它顺带写入）'''
+        if self._unsaved and (self._persist_task is None or self._persist_task.done()):
+            self._persist_task = asyncio.get_running_loop().create_task(self._persist())
+
+    async def _persist(self):
+        '''后台写入任务：写入期间新到的消息在下一轮合并写入，全部写完后退出
+        （任务不常驻，不会让对话实例一直被引用）
+        '''
+        while self._unsaved:
+            try:
+                await self._save()
+            except Exception as e:
+                # 失败的批次已放回待保存列表，下次保存（或 flush）时重试
+                logger.error(f"保存对话失败 {self.thread_id}: {e}")
+                return
 
+    async def flush(self):
+        '''等待所有待保存的消息写入完成（连接全部断开、应用关闭时调用）'''
+        task = self._persist_task
+        if task is not None and not task.done():
+            await task
+        try:
+            await self._save()
+        except Exception as e:
+            logger.error(f"保存对话失败 {self.thread_id}: {e}")
+
+    async def _save(self):
+        '''把待保存的消息批量写入数据库（数据库方面以后再处理）'''
+        if not self._unsaved:
+            return
+        messages, self._unsaved = self._unsaved, []
+        logger.opt(lazy=True).debug("保存到数据库: {} 条消息", lambda: len(messages))
+        try:
+            if self.on_saved is not None:
+                await self.on_saved(self.thread_id, self)
+        except Exception:
+            # 保存失败：这批消息放回待保存列表（排在保存期间新到的消息之前），不丢失
+            self._unsaved[:0] = messages
+            raise
@@ -0,0 +1,10 @@
+"""
+测试公共配置
+测试按 backend 目录为根导入模块（与 uvicorn 启动时一致），从仓库根目录运行 pytest 也能找到
+"""
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
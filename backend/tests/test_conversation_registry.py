@@ -0,0 +1,77 @@
+"""
+ConversationRegistry 测试：并发加载只执行一次、容量淘汰、广播组的加入与退出
+"""
+import asyncio
+import gc
+from store.conversation_registry import ConversationRegistry
+from store.conversation_store import ConversationStore
+
+
+class FakeSender:
+    async def send_chunk(self, text: str):
+        pass
+
+    async def send_raw(self, payload: bytes):
+        pass
+
+
+def test_concurrent_get_or_create_loads_once(monkeypatch):
+    calls = []
+    original = ConversationStore.create.__func__
+
+    async def slow_create(cls, thread_id, websocket=None, agent=None):
+        calls.append(thread_id)
+        await asyncio.sleep(0.01)
+        return await original(cls, thread_id, websocket, agent)
+
+    monkeypatch.setattr(ConversationStore, "create", classmethod(slow_create))
+
+    async def main():
+        registry = ConversationRegistry()
+        senders = [FakeSender() for _ in range(5)]
+        convs = await asyncio.gather(*(registry.get_or_create("t1", s, None) for s in senders))
+        return registry, convs
+
+    registry, convs = asyncio.run(main())
+    assert calls == ["t1"]
+    assert all(conv is convs[0] for conv in convs)
+    assert len(convs[0].websocket) == 5
+    assert registry.keys() == ["t1"]
+
+
+def test_capacity_eviction_keeps_referenced_conversations():
+    async def main():
+        registry = ConversationRegistry(maxsize=2)
+        convs = [await registry.get_or_create(f"t{i}", None, None) for i in range(3)]
+        return registry, convs
+
+    registry, convs = asyncio.run(main())
+    assert registry.stats()["evicted"] == 1
+    assert registry.stats()["cached"] == 2
+    # 被挤出强引用缓存的对话仍被引用，弱引用字典中依然可以找到
+    assert len(registry) == 3
+
+    del convs
+    gc.collect()
+    # 不再被引用后被回收，只剩强引用缓存中的两个
+    assert sorted(registry.keys()) == ["t1", "t2"]
+    assert registry.stats()["collected"] == 1
+
+
+def test_remove_keeps_conversation_until_last_sender_leaves():
+    async def main():
+        registry = ConversationRegistry()
+        a, b = FakeSender(), FakeSender()
+        conv = await registry.get_or_create("t1", a, None)
+        assert await registry.get_or_create("t1", b, None) is conv
+
+        await registry.remove("t1", a)
+        assert registry.keys() == ["t1"]
+        assert len(conv.websocket) == 1
+
+        await registry.remove("t1", b)
+        assert registry.keys() == []
+        # 重新连接时创建新的实例
+        assert await registry.get_or_create("t1", a, None) is not conv
+
+    asyncio.run(main())
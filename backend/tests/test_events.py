@@ -0,0 +1,35 @@
+"""
+上行事件解码测试（models.events）
+"""
+import msgspec
+import pytest
+from models.events import EventType, client_event_decoder
+
+
+def test_decode_message_event():
+    event = client_event_decoder.decode(b'{"type":"message","data":{"content":"hi"},"request_id":"req_1"}')
+    assert event.type == EventType.MESSAGE
+    assert event.data.content == "hi"
+    assert event.request_id == "req_1"
+
+
+def test_missing_fields_use_defaults():
+    event = client_event_decoder.decode(b'{}')
+    assert event.type == EventType.MESSAGE.value
+    assert event.data.content == ""
+    assert event.request_id is None
+
+
+def test_decoded_type_looks_up_enum_keyed_table():
+    """解码出的 type 是普通字符串，可直接在以 EventType 为键的分发表中查找"""
+    table = {EventType.PING: "ping", EventType.CANCEL: "cancel"}
+    assert table.get(client_event_decoder.decode(b'{"type":"ping"}').type) == "ping"
+    assert table.get(client_event_decoder.decode(b'{"type":"cancel"}').type) == "cancel"
+    assert table.get(client_event_decoder.decode(b'{"type":"unknown"}').type) is None
+
+
+def test_invalid_payload_raises():
+    with pytest.raises(msgspec.ValidationError):
+        client_event_decoder.decode(b'{"type":"message","data":{"content":1}}')
+    with pytest.raises(msgspec.DecodeError):
+        client_event_decoder.decode(b'not json')
@@ -0,0 +1,24 @@
+"""
+WebSocket 控制器测试：模块中只保留一份 websocket_endpoint 实现
+"""
+import ast
+from pathlib import Path
+from starlette.routing import WebSocketRoute
+from api.controllers import websocket_controller
+
+CONTROLLER_PATH = Path(websocket_controller.__file__)
+
+
+def test_single_websocket_endpoint_definition():
+    tree = ast.parse(CONTROLLER_PATH.read_text(encoding="utf-8"))
+    names = [
+        node.name for node in ast.walk(tree)
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == "websocket_endpoint"
+    ]
+    assert names == ["websocket_endpoint"]
+
+
+def test_single_websocket_route_registered():
+    routes = [route for route in websocket_controller.router.routes if isinstance(route, WebSocketRoute)]
+    assert len(routes) == 1
+    assert routes[0].endpoint is websocket_controller.websocket_endpoint
@@ -0,0 +1,112 @@
+"""
+WebSocketSender 测试：chunk 合并、帧序号、msgpack 编码与过载关闭
+"""
+import asyncio
+import msgspec
+import orjson
+from api.ws_sender import WebSocketSender
+from models.transport import encode_event
+
+
+class FakeWebSocket:
+    '''记录下行帧的假连接（发送器直接调用底层 send 提交ASGI消息）'''
+
+    def __init__(self, block: bool = False):
+        self.messages = []
+        self.closed_with = None
+        self._block = block
+
+    async def send(self, message):
+        if self._block:
+            await asyncio.sleep(3600)  # 模拟从不读取的客户端
+        self.messages.append(message)
+
+    async def close(self, code: int = 1000, reason=None):
+        self.closed_with = code
+
+    def frames(self):
+        return [orjson.loads(m["bytes"]) for m in self.messages]
+
+
+async def _drain(sender: WebSocketSender):
+    """等待写任务发完队列中的消息与合并窗口"""
+    for _ in range(100):
+        if sender._queue.empty():
+            break
+        await asyncio.sleep(0.005)
+    await asyncio.sleep(sender.flush_interval + 0.02)
+
+
+def test_chunks_coalesce_into_one_frame_with_seq():
+    async def main():
+        ws = FakeWebSocket()
+        sender = WebSocketSender(ws, flush_interval=0.01, max_batch=16, max_chars=1024)
+        sender.start()
+        for text in ("a", "b", "c", "d"):
+            await sender.send_chunk(text)
+        await sender.send_raw(encode_event("complete"))
+        await _drain(sender)
+        await sender.close()
+        return ws.frames()
+
+    frames = asyncio.run(main())
+    assert frames == [
+        {"type": "chunk", "content": "abcd", "seq": 1},
+        {"type": "complete", "seq": 2},
+    ]
+
+
+def test_max_chars_splits_frames():
+    async def main():
+        ws = FakeWebSocket()
+        sender = WebSocketSender(ws, flush_interval=0.01, max_batch=16, max_chars=4)
+        sender.start()
+        for text in ("ab", "cd", "ef"):
+            await sender.send_chunk(text)
+        await _drain(sender)
+        await sender.close()
+        return ws.frames()
+
+    frames = asyncio.run(main())
+    assert [f["content"] for f in frames] == ["abcd", "ef"]
+    assert [f["seq"] for f in frames] == [1, 2]
+
+
+def test_msgpack_frames():
+    async def main():
+        ws = FakeWebSocket()
+        sender = WebSocketSender(ws, flush_interval=0.01)
+        sender.use_msgpack = True
+        sender.start()
+        await sender.send_chunk("hi")
+        await sender.send_raw(encode_event("complete"))
+        await _drain(sender)
+        await sender.close()
+        return [msgspec.msgpack.decode(m["bytes"]) for m in ws.messages]
+
+    assert asyncio.run(main()) == [
+        {"type": "chunk", "content": "hi", "seq": 1},
+        {"type": "complete", "seq": 2},
+    ]
+
+
+def test_slow_client_is_closed_with_1013():
+    async def main():
+        ws = FakeWebSocket(block=True)
+        sender = WebSocketSender(ws, flush_interval=0, max_chars=64)
+        sender.put_timeout = 0.05
+        sender.start()
+        for _ in range(10000):
+            await sender.send_chunk("abcd")
+            if sender._overloaded:
+                break
+        # 队尾批次的合并有上限，之后生产方在背压处等待直到超时
+        assert sender._tail_chars <= sender.max_chars
+        # 过载关闭后的消息直接丢弃，不再阻塞生产方
+        await asyncio.wait_for(sender.send_chunk("late"), 0.01)
+        await asyncio.wait_for(sender.send_raw(encode_event("complete")), 0.01)
+        return sender, ws
+
+    sender, ws = asyncio.run(main())
+    assert sender._overloaded
+    assert ws.closed_with == 1013